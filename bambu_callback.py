@@ -1,14 +1,15 @@
 #!/usr/bin/env python3
 import sys
-import subprocess
 import os
+import io
 import zipfile
 import re
 import json
 import time
-import uuid
 import shutil
-from datetime import datetime
+import fcntl
+import atexit
+import math
 
 # ------------- CLI Arguments -------------
 # Usage: bambu_callback.py <stl_file_path> <request_id>
@@ -19,7 +20,11 @@ if len(sys.argv) < 2:
     sys.exit(1)
 
 project_file = sys.argv[1]
-request_id = sys.argv[2] if len(sys.argv) > 2 else str(uuid.uuid4())[:8]
+if len(sys.argv) > 2:
+    request_id = sys.argv[2]
+else:
+    import uuid  # only needed when run by hand; server.js always passes a request_id
+    request_id = str(uuid.uuid4())[:8]
 
 # ------------- Config Paths -------------
 CONFIG_DIR = os.environ.get("CONFIG_DIR", "/config")
@@ -71,9 +76,24 @@ output_directory = os.path.join(request_work_dir, "slice_output")
 input_extension = os.path.splitext(project_file)[1].lower()
 is_3mf_file = input_extension == ".3mf"
 
-def check_3mf_has_slice_data(filepath):
+SLICE_INFO_MEMBER = "Metadata/slice_info.config"
+PLATE_1_GCODE_MEMBER = "Metadata/plate_1.gcode"
+PLATE_GCODE_PATTERN = re.compile(r'Metadata/plate_\d+\.gcode$')
+USED_G_RE = re.compile(rb'used_g="([^"]+)"')
+USED_M_RE = re.compile(rb'used_m="([^"]+)"')
+PLATE_INDEX_RE = re.compile(rb'<metadata key="index" value="(\d+)"')
+# BambuStudio writes "; total filament weight [g] : N" in the header;
+# Orca/Prusa-style G-code uses "; filament used [g] = N" (comma-separated per extruder)
+GCODE_HEADER_RE = re.compile(
+    r'; (total estimated time|(?:total filament weight|filament used) \[g\]|(?:total filament length|filament used) \[mm\])\s*[:=]?\s*([^\r\n]*)'
+)
+GCODE_HEADER_MAX_LINES = 200
+TIME_MARKER = "total estimated time:"
+TIME_UNIT_SECONDS = {"d": 86400, "h": 3600, "m": 60, "s": 1}
+
+def check_3mf_has_slice_data(zf):
     """
-    Check if a 3MF file contains slice data (is pre-sliced).
+    Check if an open 3MF archive contains slice data (is pre-sliced).
     Returns True if slice data exists, False otherwise.
     
     Pre-sliced 3MF files from BambuStudio contain:
@@ -81,19 +101,26 @@ def check_3mf_has_slice_data(filepath):
     - Metadata/plate_N.gcode (G-code for each plate)
     """
     try:
-        with zipfile.ZipFile(filepath, 'r') as zf:
-            file_list = zf.namelist()
-            # Check for slice metadata files
-            has_slice_info = any(f.endswith('slice_info.config') for f in file_list)
-            has_gcode = any(f.endswith('.gcode') and 'plate' in f.lower() for f in file_list)
-            return has_slice_info and has_gcode
-    except Exception:
+        # Direct lookup in the zip index instead of scanning every member name
+        zf.getinfo(SLICE_INFO_MEMBER)
+    except KeyError:
         return False
+    return any(PLATE_GCODE_PATTERN.match(info.filename) for info in zf.infolist())
 
-# Check if 3MF is pre-sliced or needs slicing
+# Open the input 3MF once; the handle is reused for the slice-data check and,
+# for pre-sliced input, for metadata parsing (avoids re-reading the central directory)
+project_zf = None
 is_presliced_3mf = False
 if is_3mf_file:
-    is_presliced_3mf = check_3mf_has_slice_data(project_file)
+    try:
+        project_zf = zipfile.ZipFile(project_file, 'r')
+        is_presliced_3mf = check_3mf_has_slice_data(project_zf)
+    except Exception:
+        is_presliced_3mf = False
+    if not is_presliced_3mf and project_zf is not None:
+        # Slicer will produce a new 3MF; the input archive is no longer needed
+        project_zf.close()
+        project_zf = None
 
 # needs_slicing is True for STL files OR for 3MF files without slice data
 needs_slicing = not is_presliced_3mf
@@ -108,22 +135,98 @@ else:
     min_save_3mf = os.path.join(request_work_dir, f"{input_basename}_output.3mf")
 
 slicer_timeout_secs = int(os.environ.get("BAMBU_SLICE_TIMEOUT", "120"))
+
+# Set BAMBU_DEBUG=1 to run extra per-request diagnostics (X11/OpenGL validation),
+# write debug.log / bambu_cli_error.txt and keep failed work dirs for inspection
+BAMBU_DEBUG = os.environ.get("BAMBU_DEBUG", "0") == "1"
 debug_log_path = os.path.join(request_work_dir, "debug.log")
+settings_json_path = os.path.join(output_directory, "settings.json")
+modified_process_path = os.path.join(request_work_dir, "process_modified.json")
+cli_error_path = os.path.join(request_work_dir, "bambu_cli_error.txt")
+
+# Parsed JSON profiles are cached here as pickles (tmpfs, lives as long as the container)
+CONFIG_CACHE_DIR = os.environ.get("CONFIG_CACHE_DIR", "/dev/shm")
+# Modified process configs (base profile + request overrides) are reused from here
+PROCESS_CACHE_DIR = os.path.join(CONFIG_DIR, ".process_cache")
+# Entries unused for CLEANUP_AGE_SECONDS are swept with the work dirs; beyond this
+# count the least recently used are evicted too (overrides come from clients)
+PROCESS_CACHE_MAX_ENTRIES = int(os.environ.get("PROCESS_CACHE_MAX_ENTRIES", "64"))
 
 # Cleanup config: auto-delete work dirs older than this (seconds)
 CLEANUP_AGE_SECONDS = int(os.environ.get("CLEANUP_AGE_SECONDS", "3600"))  # 1 hour default
+# Fraction of requests that sweep WORK_BASE_DIR (1 = every request)
+CLEANUP_PROBABILITY = float(os.environ.get("CLEANUP_PROBABILITY", "0.02"))
+CLEANUP_LOCK_PATH = os.path.join(WORK_BASE_DIR, ".cleanup.lock")
 
 bambu_slicer_exe = "/opt/bambustudio/AppRun"
 
+# The container entrypoint starts (and restarts) one long-lived Xvfb and exports
+# DISPLAY. Without a DISPLAY (e.g. running outside the image), or if that display's
+# socket is gone, fall back to a per-request xvfb-run.
+X_DISPLAY = os.environ.get("DISPLAY", "")
+XVFB_RUN_COMMAND = ["xvfb-run", "--auto-servernum", "--server-args=-screen 0 1024x768x24"]
+
+# Environment overrides for the slicer (and X11/OpenGL diagnostics):
+# force X11 and disable Wayland for GLFW (BambuStudio V2.2.x)
+SLICER_ENV_OVERRIDES = {
+    "LIBGL_ALWAYS_SOFTWARE": "1",
+    "MESA_DEBUG": "silent",
+    # Force X11 for GLFW, completely disable Wayland
+    "XDG_SESSION_TYPE": "x11",
+    "WAYLAND_DISPLAY": "",
+    "GDK_BACKEND": "x11",
+    "GLFW_IM_MODULE": "",
+    "SDL_VIDEODRIVER": "x11",
+}
+
+# ------------- Cost Constants -------------
+# Grams per meter of filament, for calculating weight from length
+# Formula: weight(g) = length(m) * 100(cm/m) * (π * (diameter/2)² cm²) * density(g/cm³)
+# Assumes 1.75mm (0.175cm) PLA at 1.24 g/cm³: cross-section = π * (0.175/2)² = 0.02405 cm²
+FILAMENT_GRAMS_PER_METER = 100 * math.pi * (0.175 / 2) ** 2 * 1.24
+
+# Printer wear parts as (price, lifespan_hours); depreciation is summed once at import
+TOTAL_DEP_COST_PER_HOUR = sum(round(price / lifespan, 3) for price, lifespan in (
+    (10, 300),         # Nozzle
+    (5, 500),          # PTFE Tube (Hotend Liner)
+    (20, 1000),        # Extruder Gears
+    (30, 500),         # Build Plate Surface
+    (15, 2000),        # Cooling Fans
+    (10, 2000),        # Belts
+    (40, 3000),        # Linear Bearings and Rods
+    (15, 2000),        # Hotend Heater Cartridge
+    (10, 2000),        # Thermistor
+    (25, 3000),        # Drive Gears/Pulleys
+    (150, 5000),       # Motherboard
+    (20, 5000),        # Stepper Driver
+    (60, 5*365*24),    # LCD Screen
+    (80, 5000),        # Power Supply Unit (PSU)
+    (30, 10000),       # Stepper Motors
+    (15, 3000),        # Filament Sensor
+    (50, 5000),        # Print Bed Heating Element
+))
+
 # ------------- Helper Functions -------------
+_log_file = None
+
+def _open_log_file():
+    """Open debug.log once per run (line-buffered) and close it at exit"""
+    global _log_file
+    os.makedirs(os.path.dirname(debug_log_path), exist_ok=True)
+    _log_file = open(debug_log_path, "a", encoding="utf-8", buffering=1)
+    atexit.register(_log_file.close)
+
 def log(msg):
-    ts = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    t = time.gmtime()
+    ts = f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}T{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}Z"
     line = f"[{ts}] [{request_id}] {msg}"
     print(line, flush=True)
+    if not BAMBU_DEBUG:
+        return
     try:
-        os.makedirs(os.path.dirname(debug_log_path), exist_ok=True)
-        with open(debug_log_path, "a", encoding="utf-8") as lf:
-            lf.write(line + "\n")
+        if _log_file is None:
+            _open_log_file()
+        _log_file.write(line + "\n")
     except Exception:
         pass
 
@@ -135,35 +238,140 @@ def file_info(path):
             return "exists,size=?"
     return "missing"
 
+def load_config_cached(path):
+    """
+    Load a JSON profile, reusing a pickled copy in CONFIG_CACHE_DIR keyed by
+    path, mtime and size so concurrent requests skip re-parsing the JSON.
+
+    CONFIG_CACHE_DIR (/dev/shm) is world-writable, so a cached pickle is only
+    trusted if it is owned by us and not writable by group/other.
+    """
+    # Only needed when a process config is built; keep them off the fast path
+    import hashlib
+    import pickle
+    import tempfile
+
+    st = os.stat(path)
+    key = hashlib.md5(f"{path}:{st.st_mtime_ns}:{st.st_size}".encode()).hexdigest()
+    cache_path = os.path.join(CONFIG_CACHE_DIR, f"bambu_cfg_{key}.pkl")
+    try:
+        with open(cache_path, 'rb') as f:
+            # fstat the opened file so it can't be swapped between check and load
+            cache_st = os.fstat(f.fileno())
+            if cache_st.st_uid == os.geteuid() and not cache_st.st_mode & 0o022:
+                return pickle.load(f)
+            log(f"  Ignoring untrusted config cache file: {cache_path}")
+    except Exception:
+        pass
+
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    try:
+        # Write to a private (0600, unpredictable name) temp file, then rename
+        # so readers never see a partial pickle
+        fd, tmp_path = tempfile.mkstemp(prefix=f"bambu_cfg_{key}.", suffix=".tmp", dir=CONFIG_CACHE_DIR)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+    except Exception as e:
+        log(f"  Config cache write failed ({cache_path}): {e}")
+    return data
+
+def x_display_available(display):
+    """
+    Cheap check that a local X display is up: its Unix socket must exist.
+    Remote displays (host:N) are assumed reachable.
+    """
+    host, _, number = display.rpartition(":")
+    if host:
+        return True
+    return os.path.exists(f"/tmp/.X11-unix/X{number.split('.')[0]}")
+
+def cleanup_process_cache(now):
+    """
+    Evict PROCESS_CACHE_DIR entries unused for CLEANUP_AGE_SECONDS (and stale
+    temp files), then the least recently used beyond PROCESS_CACHE_MAX_ENTRIES.
+    Returns the number of files removed.
+    """
+    if not os.path.isdir(PROCESS_CACHE_DIR):
+        return 0
+
+    removed = 0
+    entries = []
+    with os.scandir(PROCESS_CACHE_DIR) as it:
+        for entry in it:
+            try:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                mtime = entry.stat(follow_symlinks=False).st_mtime
+                if now - mtime > CLEANUP_AGE_SECONDS:
+                    os.unlink(entry.path)
+                    removed += 1
+                elif entry.name.endswith(".json"):
+                    entries.append((mtime, entry.path))
+            except OSError:
+                pass
+
+    entries.sort(reverse=True)
+    for _, path in entries[PROCESS_CACHE_MAX_ENTRIES:]:
+        try:
+            os.unlink(path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
 def cleanup_old_work_dirs():
-    """Remove work directories older than CLEANUP_AGE_SECONDS"""
+    """Remove work directories older than CLEANUP_AGE_SECONDS and evict stale process configs"""
     if not os.path.exists(WORK_BASE_DIR):
         return
 
+    # Only one request sweeps at a time; others skip instead of waiting
+    try:
+        lock_fd = os.open(CLEANUP_LOCK_PATH, os.O_CREAT | os.O_RDWR, 0o644)
+    except OSError as e:
+        log(f"Cleanup error: {e}")
+        return
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(lock_fd)
+        return
+
     now = time.time()
     cleaned = 0
 
     try:
-        for dirname in os.listdir(WORK_BASE_DIR):
-            dirpath = os.path.join(WORK_BASE_DIR, dirname)
-            if not os.path.isdir(dirpath):
-                continue
+        # scandir reuses the directory listing's d_type, avoiding a stat per isdir check
+        with os.scandir(WORK_BASE_DIR) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_dir(follow_symlinks=False):
+                        continue
 
-            try:
-                # Check directory age by modification time
-                mtime = os.path.getmtime(dirpath)
-                age = now - mtime
+                    # Check directory age by modification time
+                    age = now - entry.stat(follow_symlinks=False).st_mtime
 
-                if age > CLEANUP_AGE_SECONDS:
-                    shutil.rmtree(dirpath, ignore_errors=True)
-                    cleaned += 1
-            except Exception:
-                pass
+                    if age > CLEANUP_AGE_SECONDS:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                        cleaned += 1
+                except Exception:
+                    pass
 
         if cleaned > 0:
             log(f"Cleanup: removed {cleaned} old work directories")
+
+        evicted = cleanup_process_cache(now)
+        if evicted > 0:
+            log(f"Cleanup: evicted {evicted} cached process configs")
     except Exception as e:
         log(f"Cleanup error: {e}")
+    finally:
+        os.close(lock_fd)  # releases the flock
 
 def cleanup_current_work_dir():
     """Remove the current request's work directory"""
@@ -174,11 +382,21 @@ def cleanup_current_work_dir():
     except Exception as e:
         log(f"Failed to cleanup work directory: {e}")
 
+def abort_request():
+    """Exit with failure; with BAMBU_DEBUG=1 the work directory is kept for post-mortem"""
+    if BAMBU_DEBUG:
+        log(f"Keeping work directory for debugging: {request_work_dir}")
+    else:
+        cleanup_current_work_dir()
+    sys.exit(1)
+
 # ------------- Main Execution -------------
 start_time = time.time()
 
-# Run cleanup of old directories before starting
-cleanup_old_work_dirs()
+# Sweep old directories on a random sample of requests so concurrent
+# requests don't all scan WORK_BASE_DIR at once
+if int.from_bytes(os.urandom(2), "big") / 65536 < CLEANUP_PROBABILITY:
+    cleanup_old_work_dirs()
 
 # Create fresh work directory for this request
 os.makedirs(request_work_dir, exist_ok=True)
@@ -223,41 +441,70 @@ needs_config_modification = needs_slicing and (
 
 if needs_config_modification:
     log("Creating modified process config...")
+    process_overrides = {}
+
+    # Add/override support settings
+    if ENABLE_SUPPORT == "1":
+        process_overrides["enable_support"] = "1"
+        process_overrides["support_type"] = SUPPORT_TYPE
+        process_overrides["support_threshold_angle"] = os.environ.get("SUPPORT_THRESHOLD_ANGLE", "30")
+        log(f"  - Supports: enabled ({SUPPORT_TYPE})")
+
+    # Add/override wall loops if provided
+    if WALL_LOOPS:
+        process_overrides["wall_loops"] = WALL_LOOPS
+        log(f"  - Wall loops: {WALL_LOOPS}")
+
+    # Add/override infill density if provided
+    if INFILL_DENSITY:
+        # Ensure it ends with % if not already
+        density_value = INFILL_DENSITY if INFILL_DENSITY.endswith('%') else f"{INFILL_DENSITY}%"
+        process_overrides["sparse_infill_density"] = density_value
+        log(f"  - Infill density: {density_value}")
+
+    # Only needed on the slicing path; keep it off the pre-sliced fast path
+    import hashlib
+
     try:
-        # Read the original process config
-        with open(print_quality_config, 'r', encoding='utf-8') as f:
-            process_data = json.load(f)
-
-        # Add/override support settings
-        if ENABLE_SUPPORT == "1":
-            process_data["enable_support"] = "1"
-            process_data["support_type"] = SUPPORT_TYPE
-            process_data["support_threshold_angle"] = os.environ.get("SUPPORT_THRESHOLD_ANGLE", "30")
-            log(f"  - Supports: enabled ({SUPPORT_TYPE})")
-
-        # Add/override wall loops if provided
-        if WALL_LOOPS:
-            process_data["wall_loops"] = WALL_LOOPS
-            log(f"  - Wall loops: {WALL_LOOPS}")
-
-        # Add/override infill density if provided
-        if INFILL_DENSITY:
-            # Ensure it ends with % if not already
-            density_value = INFILL_DENSITY if INFILL_DENSITY.endswith('%') else f"{INFILL_DENSITY}%"
-            process_data["sparse_infill_density"] = density_value
-            log(f"  - Infill density: {density_value}")
-
-        # Write to a temporary file in the work directory
-        modified_process_path = os.path.join(request_work_dir, "process_modified.json")
-        with open(modified_process_path, 'w', encoding='utf-8') as f:
-            json.dump(process_data, f, indent=4)
-
-        actual_process_config = modified_process_path
-        log(f"  Created modified process config: {modified_process_path}")
-        
-        # Debug: Log ALL keys in config to see what we have
-        log(f"  DEBUG - All keys in config ({len(process_data)} total):")
-        log(f"    {list(process_data.keys())}")
+        # Modified configs are shared across requests, keyed by the overrides
+        # and the exact version of the base profile they were built from
+        st = os.stat(print_quality_config)
+        cache_key = hashlib.sha1(
+            f"{print_quality_config}:{st.st_mtime_ns}:{st.st_size}:{json.dumps(process_overrides, sort_keys=True)}".encode()
+        ).hexdigest()[:12]
+        cached_process_path = os.path.join(PROCESS_CACHE_DIR, f"{cache_key}.json")
+
+        if os.path.exists(cached_process_path):
+            # Refresh mtime so the cache sweep evicts least-recently-used entries
+            os.utime(cached_process_path)
+            actual_process_config = cached_process_path
+            log(f"  Reusing cached process config: {cached_process_path}")
+        else:
+            # Read the original process config (parsed once per file version)
+            process_data = load_config_cached(print_quality_config)
+            process_data.update(process_overrides)
+
+            tmp_path = f"{cached_process_path}.{request_id}.tmp"
+            try:
+                # Write then rename so concurrent requests never load a partial file
+                os.makedirs(PROCESS_CACHE_DIR, exist_ok=True)
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(process_data, f)
+                os.replace(tmp_path, cached_process_path)
+                actual_process_config = cached_process_path
+            except OSError as e:
+                # Don't leave partial files behind (e.g. on ENOSPC)
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                # Cache not writable: keep a private copy in the work directory
+                log(f"  Process config cache unavailable ({e}), writing to work directory")
+                with open(modified_process_path, 'w', encoding='utf-8') as f:
+                    json.dump(process_data, f)
+                actual_process_config = modified_process_path
+
+            log(f"  Created modified process config: {actual_process_config} ({len(process_data)} keys)")
     except Exception as e:
         log(f"  WARNING: Failed to create modified process config: {e}")
         log(f"  Falling back to original process config")
@@ -266,8 +513,8 @@ if needs_config_modification:
 if not needs_slicing:
     log("=== Skipping slicing (input is pre-sliced 3MF) ===")
 else:
-    # Use xvfb-run to provide a virtual display for BambuStudio
-    # BambuStudio requires X11 even in CLI mode
+    # BambuStudio requires X11 even in CLI mode: use the shared Xvfb display
+    # (or xvfb-run when it is not available)
     # System profiles are patched in Dockerfile to include nozzle_volume_type
     # Official syntax: bambu-studio [ OPTIONS ] [ file.3mf/file.stl ... ]
 
@@ -279,10 +526,16 @@ else:
     auto_orient = "0" if is_3mf_file else "1"  # Disable for 3MF, enable for STL
     auto_arrange = "1"  # Always enabled
 
-    slice_command = [
-        "xvfb-run",
-        "--auto-servernum",
-        "--server-args=-screen 0 1024x768x24",
+    # A stat of the X socket instead of an xdpyinfo subprocess per slice: the
+    # entrypoint restarts Xvfb if it dies, so a missing socket is the case to catch
+    if X_DISPLAY and x_display_available(X_DISPLAY):
+        xvfb_prefix = []
+    else:
+        if X_DISPLAY:
+            log(f"WARNING: X display {X_DISPLAY} not available, falling back to xvfb-run")
+        xvfb_prefix = XVFB_RUN_COMMAND
+
+    slice_command = xvfb_prefix + [
         bambu_slicer_exe,
         # Auto-orient and arrange for best printability
         f"--orient={auto_orient}",
@@ -293,7 +546,7 @@ else:
         f"--load-filaments={filament_config}",
         f"--export-3mf={min_save_3mf}",
         f"--export-slicedata={output_directory}",
-        f"--export-settings={output_directory}/settings.json",
+        f"--export-settings={settings_json_path}",
         "--slice=1",
         "--min-save",
         project_file,  # Input file comes LAST per official docs
@@ -306,115 +559,158 @@ else:
 
 # ------------- Run slicer (if needed) -------------
 if needs_slicing:
-    # ------------- Enhanced Debugging: Validate X11/xvfb -------------
-    log("=== X11/xvfb validation ===")
-    try:
-        xvfb_test = subprocess.run(
-            ["xvfb-run", "--auto-servernum", "--server-args=-screen 0 1024x768x24", "xdpyinfo"],
-            capture_output=True, text=True, timeout=10
-        )
-        if xvfb_test.returncode == 0:
-            log("xvfb validation: OK (xdpyinfo succeeded)")
-        else:
-            log(f"xvfb validation: WARN returncode={xvfb_test.returncode}")
-            log(f"  stderr: {xvfb_test.stderr[:500] if xvfb_test.stderr else 'none'}")
-    except FileNotFoundError:
-        log("xvfb validation: FAIL - xvfb-run or xdpyinfo not found!")
-    except subprocess.TimeoutExpired:
-        log("xvfb validation: FAIL - xdpyinfo timed out (X server issue)")
-    except Exception as ex:
-        log(f"xvfb validation: ERROR - {ex}")
-
-    # ------------- Enhanced Debugging: Check OpenGL/Mesa -------------
-    log("=== OpenGL/Mesa validation ===")
-    try:
-        glxinfo_test = subprocess.run(
-            ["xvfb-run", "--auto-servernum", "--server-args=-screen 0 1024x768x24", "glxinfo", "-B"],
-            capture_output=True, text=True, timeout=15,
-            env={**os.environ, "LIBGL_ALWAYS_SOFTWARE": "1"}
-        )
-        if glxinfo_test.returncode == 0:
-            log("OpenGL validation: OK")
-            # Extract renderer info
-            for line in glxinfo_test.stdout.splitlines()[:10]:
-                if "renderer" in line.lower() or "vendor" in line.lower() or "version" in line.lower():
-                    log(f"  {line.strip()}")
-        else:
-            log(f"OpenGL validation: WARN returncode={glxinfo_test.returncode}")
-            log(f"  stderr: {glxinfo_test.stderr[:300] if glxinfo_test.stderr else 'none'}")
-    except FileNotFoundError:
-        log("OpenGL validation: SKIP - glxinfo not installed (optional)")
-    except subprocess.TimeoutExpired:
-        log("OpenGL validation: FAIL - glxinfo timed out")
-    except Exception as ex:
-        log(f"OpenGL validation: ERROR - {ex}")
+    # Imported here so the pre-sliced 3MF fast path doesn't pay for them at startup
+    import subprocess
+    import selectors
+
+    # X11/OpenGL diagnostics add two extra subprocesses, so they only run with
+    # BAMBU_DEBUG=1 (the server's /system_check endpoint performs the same checks)
+    if BAMBU_DEBUG:
+        # ------------- Enhanced Debugging: Validate X11/xvfb -------------
+        log(f"=== X11/xvfb validation (DISPLAY={'xvfb-run' if xvfb_prefix else X_DISPLAY}) ===")
+        try:
+            xvfb_test = subprocess.run(
+                xvfb_prefix + ["xdpyinfo"],
+                capture_output=True, text=True, timeout=10
+            )
+            if xvfb_test.returncode == 0:
+                log("xvfb validation: OK (xdpyinfo succeeded)")
+            else:
+                log(f"xvfb validation: WARN returncode={xvfb_test.returncode}")
+                log(f"  stderr: {xvfb_test.stderr[:500] if xvfb_test.stderr else 'none'}")
+        except FileNotFoundError:
+            log("xvfb validation: FAIL - xvfb-run or xdpyinfo not found!")
+        except subprocess.TimeoutExpired:
+            log("xvfb validation: FAIL - xdpyinfo timed out (X server issue)")
+        except Exception as ex:
+            log(f"xvfb validation: ERROR - {ex}")
+
+        # ------------- Enhanced Debugging: Check OpenGL/Mesa -------------
+        log("=== OpenGL/Mesa validation ===")
+        try:
+            glxinfo_test = subprocess.run(
+                xvfb_prefix + ["glxinfo", "-B"],
+                capture_output=True, text=True, timeout=15,
+                env={**os.environ, **SLICER_ENV_OVERRIDES}
+            )
+            if glxinfo_test.returncode == 0:
+                log("OpenGL validation: OK")
+                # Extract renderer info
+                for line in glxinfo_test.stdout.splitlines()[:10]:
+                    if "renderer" in line.lower() or "vendor" in line.lower() or "version" in line.lower():
+                        log(f"  {line.strip()}")
+            else:
+                log(f"OpenGL validation: WARN returncode={glxinfo_test.returncode}")
+                log(f"  stderr: {glxinfo_test.stderr[:300] if glxinfo_test.stderr else 'none'}")
+        except FileNotFoundError:
+            log("OpenGL validation: SKIP - glxinfo not installed (optional)")
+        except subprocess.TimeoutExpired:
+            log("OpenGL validation: FAIL - glxinfo timed out")
+        except Exception as ex:
+            log(f"OpenGL validation: ERROR - {ex}")
 
     # ------------- Run slicer with real-time monitoring -------------
-    import threading
+    HEARTBEAT_SECS = 10
 
-    process_alive = True
+    def log_slicer_progress():
+        """Log elapsed time and any output files the slicer has produced so far"""
+        log(f"  ... slicer running ({time.time() - t0:.0f}s elapsed)")
 
-    def monitor_output():
-        """Monitor process output in real-time"""
-        global process_alive
-        last_log_time = time.time()
+        # Check if output files are being created
+        if os.path.exists(min_save_3mf):
+            log(f"  ... 3mf file detected: {file_info(min_save_3mf)}")
+        if os.path.exists(output_directory):
+            try:
+                files = os.listdir(output_directory)
+                if files:
+                    log(f"  ... output dir has {len(files)} files: {files[:5]}")
+            except Exception:
+                pass
 
-        while process_alive:
-            # Check for output every 0.5 seconds
-            time.sleep(0.5)
-            elapsed = time.time() - t0
+    def output_tail(data, size):
+        """Decode only the last `size` bytes of captured slicer output"""
+        return data[-size:].decode('utf-8', errors='replace')
 
-            # Log progress every 10 seconds
-            if time.time() - last_log_time >= 10:
-                log(f"  ... slicer running ({elapsed:.0f}s elapsed)")
-                last_log_time = time.time()
+    def collect_slicer_output(process, timeout_secs):
+        """
+        Drain the slicer's stdout/stderr as data arrives and wait for it to exit.
+        A pidfd (Linux 5.3+) in the same selector signals exit, so the loop wakes
+        only on output, process exit or a heartbeat every HEARTBEAT_SECS.
+        Returns (stdout, stderr) as undecoded bytes; raises subprocess.TimeoutExpired carrying the
+        output read so far if timeout_secs is exceeded.
+        """
+        chunks = {process.stdout: [], process.stderr: []}
 
-                # Check if output files are being created
-                if os.path.exists(min_save_3mf):
-                    log(f"  ... 3mf file detected: {file_info(min_save_3mf)}")
-                if os.path.exists(output_directory):
-                    try:
-                        files = os.listdir(output_directory)
-                        if files:
-                            log(f"  ... output dir has {len(files)} files: {files[:5]}")
-                    except Exception:
-                        pass
+        def joined(pipe):
+            return b"".join(chunks[pipe])
+
+        def timeout_expired():
+            return subprocess.TimeoutExpired(
+                process.args, timeout_secs,
+                output=joined(process.stdout), stderr=joined(process.stderr)
+            )
+
+        deadline = time.monotonic() + timeout_secs
+        next_heartbeat = time.monotonic() + HEARTBEAT_SECS
+
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except (AttributeError, OSError):
+            pidfd = None  # No pidfd support: fall back to process.wait() below
+
+        try:
+            with selectors.DefaultSelector() as sel:
+                sel.register(process.stdout, selectors.EVENT_READ)
+                sel.register(process.stderr, selectors.EVENT_READ)
+                if pidfd is not None:
+                    sel.register(pidfd, selectors.EVENT_READ)
+
+                while sel.get_map():
+                    now = time.monotonic()
+                    if now >= deadline:
+                        raise timeout_expired()
+                    if now >= next_heartbeat:
+                        log_slicer_progress()
+                        next_heartbeat = now + HEARTBEAT_SECS
+
+                    for key, _ in sel.select(timeout=min(deadline, next_heartbeat) - now):
+                        if key.fd == pidfd:
+                            # Slicer exited; keep draining until both pipes reach EOF
+                            sel.unregister(pidfd)
+                            continue
+                        data = os.read(key.fd, 65536)
+                        if data:
+                            chunks[key.fileobj].append(data)
+                        else:
+                            # EOF: the slicer closed this pipe
+                            sel.unregister(key.fileobj)
+
+            try:
+                process.wait(timeout=max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                raise timeout_expired()
+        finally:
+            if pidfd is not None:
+                os.close(pidfd)
+
+        return joined(process.stdout), joined(process.stderr)
 
     log("=== Starting slicer process ===")
     try:
         t0 = time.time()
 
-        # Use Popen for real-time monitoring
-        # Set environment to force X11 and disable Wayland for GLFW (BambuStudio V2.2.x)
-        slicer_env = {
-            **os.environ,
-            "LIBGL_ALWAYS_SOFTWARE": "1",
-            "MESA_DEBUG": "silent",
-            # Force X11 for GLFW, completely disable Wayland
-            "XDG_SESSION_TYPE": "x11",
-            "WAYLAND_DISPLAY": "",
-            "GDK_BACKEND": "x11",
-            "GLFW_IM_MODULE": "",
-            "SDL_VIDEODRIVER": "x11",
-        }
+        # Use Popen so output can be drained while the slicer runs
         process = subprocess.Popen(
             slice_command,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True,
-            encoding='utf-8',
-            env=slicer_env
+            env={**os.environ, **SLICER_ENV_OVERRIDES}
         )
 
         log(f"Slicer PID: {process.pid}")
 
-        # Start monitoring thread
-        monitor_thread = threading.Thread(target=monitor_output, daemon=True)
-        monitor_thread.start()
-
         try:
-            stdout, stderr = process.communicate(timeout=slicer_timeout_secs)
-            process_alive = False
+            stdout, stderr = collect_slicer_output(process, slicer_timeout_secs)
 
             dt = time.time() - t0
 
@@ -425,47 +721,37 @@ if needs_slicing:
                 # Log last few lines of output for debugging
                 if stdout:
                     log("Slicer stdout (last 500 chars):")
-                    for line in stdout[-500:].splitlines()[-10:]:
+                    for line in output_tail(stdout, 500).splitlines()[-10:]:
                         log(f"  {line}")
-
-                # Write output to work directory
-                try:
-                    with open(os.path.join(request_work_dir, "bambu_cli_output.txt"), "w", encoding="utf-8") as log_file:
-                        log_file.write(stdout or "")
-                        log_file.write("\n--- STDERR ---\n")
-                        log_file.write(stderr or "")
-                    log("Wrote bambu_cli_output.txt")
-                except Exception as e:
-                    log(f"Failed writing bambu_cli_output.txt: {e}")
             else:
                 log(f"ERROR: slicer failed returncode={process.returncode}")
-                log(f"Slicer stdout (last 1000 chars): {stdout[-1000:] if stdout else 'none'}")
-                log(f"Slicer stderr (last 1000 chars): {stderr[-1000:] if stderr else 'none'}")
-
-                try:
-                    with open(os.path.join(request_work_dir, "bambu_cli_error.txt"), "w", encoding="utf-8") as error_file:
-                        error_file.write(f"Error: returncode={process.returncode}\n")
-                        error_file.write("Standard Output:\n" + (stdout or "") + "\n")
-                        error_file.write("Standard Error:\n" + (stderr or "") + "\n")
-                    log("Wrote bambu_cli_error.txt")
-                except Exception as e2:
-                    log(f"Failed writing bambu_cli_error.txt: {e2}")
-                cleanup_current_work_dir()
-                sys.exit(1)
+                log(f"Slicer stdout (last 1000 chars): {output_tail(stdout, 1000) if stdout else 'none'}")
+                log(f"Slicer stderr (last 1000 chars): {output_tail(stderr, 1000) if stderr else 'none'}")
 
-        except subprocess.TimeoutExpired:
-            process_alive = False
+                if BAMBU_DEBUG:
+                    try:
+                        with open(cli_error_path, "wb") as error_file:
+                            error_file.write(f"Error: returncode={process.returncode}\n".encode())
+                            error_file.write(b"Standard Output:\n" + stdout + b"\n")
+                            error_file.write(b"Standard Error:\n" + stderr + b"\n")
+                        log("Wrote bambu_cli_error.txt")
+                    except Exception as e2:
+                        log(f"Failed writing bambu_cli_error.txt: {e2}")
+                abort_request()
+
+        except subprocess.TimeoutExpired as timeout_error:
             log(f"ERROR: slicer TIMEOUT after {slicer_timeout_secs}s")
 
-            # Try to get partial output
+            # Partial output was collected before the deadline
+            stdout, stderr = timeout_error.output or b"", timeout_error.stderr or b""
             try:
                 process.kill()
-                stdout, stderr = process.communicate(timeout=5)
+                process.wait(timeout=5)
             except Exception:
-                stdout, stderr = "", ""
+                pass
 
-            log(f"Partial stdout (last 1000 chars): {stdout[-1000:] if stdout else 'none'}")
-            log(f"Partial stderr (last 1000 chars): {stderr[-1000:] if stderr else 'none'}")
+            log(f"Partial stdout (last 1000 chars): {output_tail(stdout, 1000) if stdout else 'none'}")
+            log(f"Partial stderr (last 1000 chars): {output_tail(stderr, 1000) if stderr else 'none'}")
 
             # Check what files were created before timeout
             log("Files created before timeout:")
@@ -478,135 +764,166 @@ if needs_slicing:
             except Exception:
                 pass
 
-            try:
-                with open(os.path.join(request_work_dir, "bambu_cli_error.txt"), "w", encoding="utf-8") as errf:
-                    errf.write(f"Timeout after {slicer_timeout_secs}s\n")
-                    errf.write(f"Partial STDOUT:\n{stdout or 'none'}\n")
-                    errf.write(f"Partial STDERR:\n{stderr or 'none'}\n")
-            except Exception as e2:
-                log(f"Failed writing bambu_cli_error.txt: {e2}")
+            if BAMBU_DEBUG:
+                try:
+                    with open(cli_error_path, "wb") as errf:
+                        errf.write(f"Timeout after {slicer_timeout_secs}s\n".encode())
+                        errf.write(b"Partial STDOUT:\n" + (stdout or b"none") + b"\n")
+                        errf.write(b"Partial STDERR:\n" + (stderr or b"none") + b"\n")
+                except Exception as e2:
+                    log(f"Failed writing bambu_cli_error.txt: {e2}")
 
-            cleanup_current_work_dir()
-            sys.exit(1)
+            abort_request()
 
     except Exception as e:
-        process_alive = False
         log(f"ERROR: Unexpected exception: {type(e).__name__}: {e}")
         import traceback
         log(traceback.format_exc())
-        cleanup_current_work_dir()
-        sys.exit(1)
+        abort_request()
 
     # After slicing: verify outputs
     log("Post-slice output check:")
     log(f"  3mf: {min_save_3mf} -> {file_info(min_save_3mf)}")
     log(f"  slicedata dir: {output_directory} -> {file_info(output_directory)}")
-log(f"  settings.json: {os.path.join(output_directory,'settings.json')} -> {file_info(os.path.join(output_directory,'settings.json'))}")
+log(f"  settings.json: {settings_json_path} -> {file_info(settings_json_path)}")
 
-used_g_pattern = re.compile(r'used_g="([^"]+)"')
-used_m_pattern = re.compile(r'used_m="([^"]+)"')
 used_g_value = None
 used_m_value = None
 printing_time_line = None
 
-# Default filament density (PLA = 1.24 g/cm³) for calculating weight from length
-# Formula: weight(g) = length(m) * (π * (diameter/2)² cm²) * density(g/cm³)
-# For 1.75mm filament: cross-section area = π * (0.175/2)² = 0.02405 cm²
-DEFAULT_FILAMENT_DENSITY = 1.24  # g/cm³ for PLA
-FILAMENT_DIAMETER_CM = 0.175  # 1.75mm in cm
-FILAMENT_CROSS_SECTION = 3.14159 * (FILAMENT_DIAMETER_CM / 2) ** 2  # cm²
+def parse_bambu_time(line):
+    """
+    Parse the "total estimated time: 1d 2h 3m 4s" G-code header field in a
+    single pass (no regex backtracking). Returns hours, or 0 if absent.
+    """
+    start = line.find(TIME_MARKER)
+    if start < 0:
+        return 0
+    seconds = 0
+    number = 0
+    for c in line[start + len(TIME_MARKER):]:
+        if '0' <= c <= '9':
+            number = number * 10 + ord(c) - 48
+        elif c in TIME_UNIT_SECONDS:
+            seconds += number * TIME_UNIT_SECONDS[c]
+            number = 0
+        elif c == ';' or c == '\n':
+            break
+    return seconds / 3600
+
+def parse_3mf_metadata(zf):
+    """
+    Extract filament usage and the print time header line from an open 3MF.
+    Returns (used_g, used_m, printing_time_line) for plate 1; missing values
+    are None. Filament usage is the total across all filaments/extruders.
+
+    The plate_1.gcode header is read first; slice_info.config is only
+    decompressed when the header lacks the filament weight or length.
+    """
+    used_g = None
+    used_m = None
+    time_line = None
+    log(f".3mf contains {len(zf.infolist())} files")
+
+    try:
+        zf.getinfo(PLATE_1_GCODE_MEMBER)
+        has_plate_gcode = True
+    except KeyError:
+        has_plate_gcode = False
+    if has_plate_gcode:
+        log(f"Reading {PLATE_1_GCODE_MEMBER} (header lines)")
+        with zf.open(PLATE_1_GCODE_MEMBER) as extracted_file:
+            try:
+                # Only the header is needed; avoid decompressing/decoding the whole G-code
+                for i, line in enumerate(io.TextIOWrapper(extracted_file, encoding='utf-8', errors='ignore')):
+                    if i >= GCODE_HEADER_MAX_LINES or line.startswith('; HEADER_BLOCK_END'):
+                        break
+                    match = GCODE_HEADER_RE.search(line)
+                    if not match:
+                        continue
+                    key, value = match.group(1), match.group(2)
+                    if key == 'total estimated time':
+                        time_line = line.rstrip('\r\n')
+                        log(f"printing_time_line='{time_line[:120]}'")
+                    elif key.endswith('[g]'):
+                        used_g = str(sum(float(v) for v in value.split(',')))
+                        log(f"Parsed used_g={used_g} from G-code header")
+                    else:
+                        used_m = str(sum(float(v) for v in value.split(',')) / 1000)
+                        log(f"Parsed used_m={used_m} from G-code header")
+            except Exception as e:
+                log(f"Failed parsing plate_1.gcode: {e}")
+
+    if used_g is not None and used_m is not None:
+        return used_g, used_m, time_line
+
+    try:
+        zf.getinfo(SLICE_INFO_MEMBER)
+        has_slice_info = True
+    except KeyError:
+        has_slice_info = False
+    if has_slice_info:
+        log(f"Reading {SLICE_INFO_MEMBER}")
+        # Only plate 1 is billed (print time comes from plate_1.gcode too), so sum
+        # the <filament> entries of that <plate>, matching the G-code header totals
+        plate_ordinal = 0
+        plate_index = b"1"  # entries outside any <plate> count as plate 1
+        totals = {}  # plate index -> [used_g, used_m, saw_g, saw_m]
+        try:
+            # slice_info.config is small: read it as bytes and skip per-line decoding
+            for line in zf.read(SLICE_INFO_MEMBER).splitlines():
+                if b'<plate' in line:
+                    # Default to the plate's position until its index metadata is seen
+                    plate_ordinal += 1
+                    plate_index = str(plate_ordinal).encode()
+                    continue
+                match_index = PLATE_INDEX_RE.search(line)
+                if match_index:
+                    plate_index = match_index.group(1)
+                    continue
+                if b'<filament' in line:
+                    plate_totals = totals.setdefault(plate_index, [0.0, 0.0, False, False])
+                    match_g = USED_G_RE.search(line)
+                    if match_g:
+                        plate_totals[0] += float(match_g.group(1))
+                        plate_totals[2] = True
+                    # used_m is the fallback when used_g is 0
+                    match_m = USED_M_RE.search(line)
+                    if match_m:
+                        plate_totals[1] += float(match_m.group(1))
+                        plate_totals[3] = True
+            if b"1" in totals:
+                total_g, total_m, saw_g, saw_m = totals[b"1"]
+                used_g = str(total_g) if saw_g else None
+                used_m = str(total_m) if saw_m else None
+            else:
+                used_g = used_m = None
+            log(f"Parsed used_g={used_g} used_m={used_m} (plate 1, summed over filaments)")
+        except Exception as e:
+            log(f"Failed parsing slice_info.config: {e}")
+    return used_g, used_m, time_line
 
 # Parse 3mf contents
 if not os.path.exists(min_save_3mf):
     log("ERROR: .3mf file missing, cannot parse; exiting.")
-    cleanup_current_work_dir()
-    sys.exit(1)
+    abort_request()
 
 log("Opening .3mf zip to parse metadata...")
 try:
-    with zipfile.ZipFile(min_save_3mf, 'r') as zf:
-        file_list = zf.namelist()
-        log(f".3mf contains {len(file_list)} files")
-        for file_name in file_list:
-            if file_name == "Metadata/slice_info.config":
-                log("Reading Metadata/slice_info.config")
-                with zf.open(file_name) as extracted_file:
-                    try:
-                        content = extracted_file.read().decode('utf-8', errors='ignore')
-                        for line in content.splitlines():
-                            if line.strip().startswith('<filament'):
-                                # Try to get used_g first
-                                match_g = used_g_pattern.search(line)
-                                if match_g:
-                                    used_g_value = match_g.group(1)
-                                    log(f"Parsed used_g={used_g_value}")
-                                # Also get used_m as fallback
-                                match_m = used_m_pattern.search(line)
-                                if match_m:
-                                    used_m_value = match_m.group(1)
-                                    log(f"Parsed used_m={used_m_value}")
-                    except Exception as e:
-                        log(f"Failed parsing slice_info.config: {e}")
-
-            if file_name == "Metadata/plate_1.gcode":
-                log("Reading Metadata/plate_1.gcode (header lines)")
-                with zf.open(file_name) as extracted_file:
-                    try:
-                        content = extracted_file.read().decode('utf-8', errors='ignore')
-                        lines = content.splitlines()
-                        if len(lines) >= 3:
-                            printing_time_line = lines[2]
-                            log(f"printing_time_line='{printing_time_line[:120]}'")
-                    except Exception as e:
-                        log(f"Failed parsing plate_1.gcode: {e}")
-
+    zf = project_zf if project_zf is not None else zipfile.ZipFile(min_save_3mf, 'r')
+    try:
+        used_g_value, used_m_value, printing_time_line = parse_3mf_metadata(zf)
+    finally:
+        zf.close()
 except zipfile.BadZipFile as e:
     log(f"ERROR: BadZipFile for {min_save_3mf}: {e}")
-    cleanup_current_work_dir()
-    sys.exit(1)
+    abort_request()
 
 # Compute time
-if printing_time_line:
-    match = re.search(r'total estimated time: ((?:(\d+)d\s*)?(?:(\d+)h\s*)?(?:(\d+)m\s*)?(?:(\d+)s)?)', printing_time_line)
-    if match:
-        days = int(match.group(2)) if match.group(2) else 0
-        hours = int(match.group(3)) if match.group(3) else 0
-        minutes = int(match.group(4)) if match.group(4) else 0
-        seconds = int(match.group(5)) if match.group(5) else 0
-        Total_printing_hours = days * 24 + hours + minutes / 60 + seconds / 3600
-    else:
-        Total_printing_hours = 0
-else:
-    Total_printing_hours = 0
+Total_printing_hours = parse_bambu_time(printing_time_line) if printing_time_line else 0
 log(f"Total_printing_hours={Total_printing_hours:.3f}")
 
-def calculate_cost_per_hour(item_name, cost, lifespan_hours):
-    return item_name, round(cost / lifespan_hours, 3)
-
-items = [
-    {"name": "Nozzle", "price": 10, "lifespan_min": 300},
-    {"name": "PTFE Tube (Hotend Liner)", "price": 5, "lifespan_min": 500},
-    {"name": "Extruder Gears", "price": 20, "lifespan_min": 1000},
-    {"name": "Build Plate Surface", "price": 30, "lifespan_min": 500},
-    {"name": "Cooling Fans", "price": 15, "lifespan_min": 2000},
-    {"name": "Belts", "price": 10, "lifespan_min": 2000},
-    {"name": "Linear Bearings and Rods", "price": 40, "lifespan_min": 3000},
-    {"name": "Hotend Heater Cartridge", "price": 15, "lifespan_min": 2000},
-    {"name": "Thermistor", "price": 10, "lifespan_min": 2000},
-    {"name": "Drive Gears/Pulleys", "price": 25, "lifespan_min": 3000},
-    {"name": "Motherboard", "price": 150, "lifespan_min": 5000},
-    {"name": "Stepper Driver", "price": 20, "lifespan_min": 5000},
-    {"name": "LCD Screen", "price": 60, "lifespan_min": 5*365*24},
-    {"name": "Power Supply Unit (PSU)", "price": 80, "lifespan_min": 5000},
-    {"name": "Stepper Motors", "price": 30, "lifespan_min": 10000},
-    {"name": "Filament Sensor", "price": 15, "lifespan_min": 3000},
-    {"name": "Print Bed Heating Element", "price": 50, "lifespan_min": 5000},
-]
-total_dep_cost_per_hour = 0
-for item in items:
-    name, cost_per_hour = calculate_cost_per_hour(item["name"], item["price"], item["lifespan_min"])
-    total_dep_cost_per_hour += cost_per_hour
-log(f"Depreciation cost per hour total={total_dep_cost_per_hour:.3f}")
+log(f"Depreciation cost per hour total={TOTAL_DEP_COST_PER_HOUR:.3f}")
 
 def calculate_electricity_cost(power_watts, electricity_rate_per_kwh):
     return round((power_watts / 1000) * electricity_rate_per_kwh, 3)
@@ -630,14 +947,13 @@ total_used_grams = float(used_g_value) if used_g_value else 0
 # BambuStudio V2.2.x CLI doesn't resolve filament density inheritance, so used_g is often 0
 if total_used_grams == 0 and used_m_value:
     used_meters = float(used_m_value)
-    # Calculate weight: length(m) * 100(cm/m) * cross_section(cm²) * density(g/cm³)
-    total_used_grams = used_meters * 100 * FILAMENT_CROSS_SECTION * DEFAULT_FILAMENT_DENSITY
-    log(f"Calculated used_g from used_m: {used_meters}m * {FILAMENT_CROSS_SECTION:.5f}cm² * {DEFAULT_FILAMENT_DENSITY}g/cm³ = {total_used_grams:.2f}g")
+    total_used_grams = used_meters * FILAMENT_GRAMS_PER_METER
+    log(f"Calculated used_g from used_m: {used_meters}m * {FILAMENT_GRAMS_PER_METER:.4f}g/m = {total_used_grams:.2f}g")
 
 filament_cost = calculate_filament_cost(filament_price, spool_weight, total_used_grams)
 log(f"Filament price={filament_price} used_g={total_used_grams:.2f} -> filament_cost={filament_cost:.2f}")
 
-total_depreciation_cost = Total_printing_hours * total_dep_cost_per_hour
+total_depreciation_cost = Total_printing_hours * TOTAL_DEP_COST_PER_HOUR
 total_electricity_cost = Total_printing_hours * electricity_cost_per_hour
 total_cost = total_depreciation_cost + total_electricity_cost + filament_cost
 
@@ -0,0 +1,38 @@
+#!/bin/sh
+#
+# Start a single long-lived Xvfb for all slicer runs, then exec the server.
+# bambu_callback.py uses $DISPLAY directly instead of spawning xvfb-run per request
+# (and falls back to xvfb-run itself if the shared display stops responding).
+#
+set -e
+
+: "${DISPLAY:=:99}"
+export DISPLAY
+
+display_num="${DISPLAY#:}"
+display_num="${display_num%%.*}"
+
+# Keep Xvfb running: restart it if it ever exits. Stale lock/socket files
+# (e.g. left in the writable layer across `docker restart`) would otherwise
+# make Xvfb refuse to start with "Server is already active".
+(
+    while true; do
+        rm -f "/tmp/.X${display_num}-lock" "/tmp/.X11-unix/X${display_num}"
+        Xvfb "${DISPLAY}" -screen 0 1024x768x24 -nolisten tcp || true
+        echo "docker-entrypoint: Xvfb on ${DISPLAY} exited, restarting" >&2
+        sleep 1
+    done
+) &
+
+# Wait (up to ~10s) for the X server to accept connections
+i=0
+until xdpyinfo >/dev/null 2>&1; do
+    i=$((i + 1))
+    if [ "$i" -ge 50 ]; then
+        echo "docker-entrypoint: Xvfb did not come up on ${DISPLAY}, aborting" >&2
+        exit 1
+    fi
+    sleep 0.2
+done
+
+exec "$@"